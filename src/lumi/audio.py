@@ -2,20 +2,29 @@
 
 Pure numpy on 16-bit mono PCM. Two jobs, both driven by per-frame RMS energy:
 
-- gate_silences: collapse long silences so dead air isn't transcribed.
+- gate_silences: collapse long silences and trim the edges so dead air isn't
+  uploaded or transcribed.
 - split_at_silences: cut audio into chunks the remote server can take in one
   request (its models see at most ~30s per forward pass), cutting at the
   quietest point near each boundary so words stay intact.
+
+Plus a coarse spectral fingerprint (fingerprint / fingerprint_distance) for
+recognizing a repeat of an earlier utterance without transcribing it.
 """
 
+import functools
+import io
 import wave
+from typing import BinaryIO
 
 import numpy as np
 
 FRAME_MS = 30  # energy analysis frame
 
 # Gating: silences longer than MAX_SILENCE_S are shortened to KEPT_SILENCE_S.
-# Short pauses are kept — they carry phrasing/punctuation cues.
+# Short pauses are kept — they carry phrasing/punctuation cues. Leading and
+# trailing silence (waiting after the start sound, before the stop tap) carries
+# no cues, so any of it beyond KEPT_SILENCE_S goes.
 MAX_SILENCE_S = 0.8
 KEPT_SILENCE_S = 0.3
 
@@ -27,6 +36,12 @@ SILENCE_ABS_FLOOR = 100.0  # int16 RMS units
 
 MAX_CHUNK_S = 28.0  # stay under the server's 30s window
 
+# Fingerprint: log-mel energies over 25ms windows every 10ms, averaged down to
+# FINGERPRINT_STEPS time steps so takes of any length compare cheaply.
+FFT_SIZE = 512
+N_MELS = 40
+FINGERPRINT_STEPS = 20
+
 
 def load_wav(path: str) -> tuple[np.ndarray, int]:
     """Read a mono 16-bit WAV into an int16 array. Returns (samples, rate)."""
@@ -38,7 +53,13 @@ def load_wav(path: str) -> tuple[np.ndarray, int]:
     return samples, rate
 
 
-def save_wav(path: str, samples: np.ndarray, rate: int) -> None:
+def wav_duration(path: str) -> float:
+    """Length of a WAV in seconds, from its header alone."""
+    with wave.open(path, "rb") as wf:
+        return wf.getnframes() / wf.getframerate()
+
+
+def save_wav(path: str | BinaryIO, samples: np.ndarray, rate: int) -> None:
     with wave.open(path, "wb") as wf:
         wf.setnchannels(1)
         wf.setsampwidth(2)
@@ -46,6 +67,13 @@ def save_wav(path: str, samples: np.ndarray, rate: int) -> None:
         wf.writeframes(samples.astype(np.int16).tobytes())
 
 
+def wav_bytes(samples: np.ndarray, rate: int) -> bytes:
+    """Encode as an in-memory mono 16-bit WAV, e.g. for upload without a temp file."""
+    buf = io.BytesIO()
+    save_wav(buf, samples, rate)
+    return buf.getvalue()
+
+
 def _frame_rms(samples: np.ndarray, rate: int) -> tuple[np.ndarray, int]:
     """Per-frame RMS energy. Returns (rms array, frame length in samples)."""
     frame_len = max(1, int(rate * FRAME_MS / 1000))
@@ -53,7 +81,8 @@ def _frame_rms(samples: np.ndarray, rate: int) -> tuple[np.ndarray, int]:
     if n_frames == 0:
         return np.array([]), frame_len
     frames = samples[: n_frames * frame_len].astype(np.float64).reshape(n_frames, frame_len)
-    return np.sqrt((frames**2).mean(axis=1)), frame_len
+    # Row-wise dot product: sums the squares without a squared copy of the audio
+    return np.sqrt(np.einsum("ij,ij->i", frames, frames) / frame_len), frame_len
 
 
 def _silent_frames(rms: np.ndarray) -> np.ndarray:
@@ -66,7 +95,9 @@ def _silent_frames(rms: np.ndarray) -> np.ndarray:
 
 
 def gate_silences(samples: np.ndarray, rate: int) -> np.ndarray:
-    """Shorten every silence run longer than MAX_SILENCE_S to KEPT_SILENCE_S."""
+    """Shorten every silence run longer than MAX_SILENCE_S, and leading/trailing
+    silence longer than KEPT_SILENCE_S, to KEPT_SILENCE_S. At the edges the
+    part next to the speech is kept."""
     rms, frame_len = _frame_rms(samples, rate)
     silent = _silent_frames(rms)
     if not silent.any():
@@ -75,16 +106,20 @@ def gate_silences(samples: np.ndarray, rate: int) -> np.ndarray:
     max_run = max(1, int(MAX_SILENCE_S * 1000 / FRAME_MS))
     keep_run = max(1, int(KEPT_SILENCE_S * 1000 / FRAME_MS))
 
-    keep = np.ones(len(silent), dtype=bool)
-    run_start = None
-    for i, s in enumerate([*silent, False]):  # sentinel closes a trailing run
-        if s and run_start is None:
-            run_start = i
-        elif not s and run_start is not None:
-            run_len = i - run_start
-            if run_len > max_run:
-                keep[run_start + keep_run : i] = False
-            run_start = None
+    # Silence runs as [start, end) frame ranges
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], silent.astype(np.int8), [0]])))
+    starts, ends = edges[::2], edges[1::2]
+    leading = starts == 0
+    limit = np.where(leading | (ends == len(silent)), keep_run, max_run)
+    too_long = (ends - starts) > limit
+    # Frames to drop: all but the keep_run frames next to the speech
+    drop_from = np.where(leading, starts, starts + keep_run)[too_long]
+    drop_to = np.where(leading, ends - keep_run, ends)[too_long]
+
+    depth = np.zeros(len(silent) + 1, dtype=np.int32)
+    np.add.at(depth, drop_from, 1)
+    np.add.at(depth, drop_to, -1)
+    keep = np.cumsum(depth[:-1]) == 0
 
     sample_mask = np.repeat(keep, frame_len)
     tail = samples[len(sample_mask) :]  # partial frame at the end, always kept
@@ -111,3 +146,48 @@ def split_at_silences(samples: np.ndarray, rate: int) -> list[np.ndarray]:
         start = cut
     chunks.append(samples[start:])
     return chunks
+
+
+@functools.cache
+def _mel_filters(rate: int) -> np.ndarray:
+    """Triangular mel filterbank, shape (N_MELS, FFT_SIZE // 2 + 1)."""
+    max_mel = 2595 * np.log10(1 + rate / 2 / 700)
+    hz = 700 * (10 ** (np.linspace(0, max_mel, N_MELS + 2) / 2595) - 1)
+    bins = np.fft.rfftfreq(FFT_SIZE, 1 / rate)
+    lo, center, hi = hz[:-2, None], hz[1:-1, None], hz[2:, None]
+    rising = (bins - lo) / (center - lo)
+    falling = (hi - bins) / (hi - center)
+    return np.maximum(0, np.minimum(rising, falling))
+
+
+def fingerprint(samples: np.ndarray, rate: int) -> np.ndarray | None:
+    """Coarse spectral shape of an utterance, shape (FINGERPRINT_STEPS, N_MELS).
+
+    Each step is a unit vector of mean-removed log-mel energies, so loudness
+    and mic coloring largely cancel out. None if the audio is too short.
+    """
+    win, hop = int(rate * 0.025), int(rate * 0.010)
+    if len(samples) < win + hop * (FINGERPRINT_STEPS - 1):
+        return None
+    frames = np.lib.stride_tricks.sliding_window_view(samples.astype(np.float64), win)[::hop]
+    power = np.abs(np.fft.rfft(frames * np.hanning(win), n=FFT_SIZE)) ** 2
+    log_mel = np.log(power @ _mel_filters(rate).T + 1e-6)
+    steps = np.stack([s.mean(axis=0) for s in np.array_split(log_mel, FINGERPRINT_STEPS)])
+    steps -= steps.mean(axis=0)
+    return steps / (np.linalg.norm(steps, axis=1, keepdims=True) + 1e-9)
+
+
+def fingerprint_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean cosine distance along the best time alignment (DTW) of two fingerprints.
+
+    0 for identical fingerprints, around 1 for unrelated ones; the alignment
+    absorbs differences in speaking rate.
+    """
+    cost = 1 - a @ b.T
+    n, m = cost.shape
+    acc = np.full((n + 1, m + 1), np.inf)
+    acc[0, 0] = 0
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            acc[i, j] = cost[i - 1, j - 1] + min(acc[i - 1, j], acc[i, j - 1], acc[i - 1, j - 1])
+    return float(acc[n, m] / (n + m))
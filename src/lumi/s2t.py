@@ -9,8 +9,8 @@ import subprocess
 import tempfile
 import threading
 import time
-import traceback
 import wave
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pyaudio
@@ -19,7 +19,7 @@ from nava import play
 from pynput import keyboard
 from pynput.keyboard import Controller, Key
 
-from lumi.transcribe import SERVICES, transcribe
+from lumi.transcribe import SERVICES, preload, transcribe
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,6 +33,7 @@ DOUBLE_TAP_TIME = 0.3  # Maximum time between taps to count as double-tap
 TEMP_DIR = os.path.join(tempfile.gettempdir(), "speech_to_text")
 START_SOUND_FILE = "ding.mp3"  # Located in the same folder as this module
 STOP_SOUND_FILE = "dong.mp3"
+START_SOUND_S = 0.5  # Opening the mic cuts off playback, so the start sound gets this long first
 PREFERRED_MICS = ("airpods", "macbook")  # Name substrings, first match wins; then system default
 SILENT_PEAK = 100  # int16 peak below this means the mic delivered no usable signal
 # (a dead capture stream — e.g. idle AirPods over Bluetooth — yields exact zeros;
@@ -43,28 +44,38 @@ EARLY_SILENCE_CHECK_S = 3  # Kill the take this many seconds in if the mic only
 SERVICE = "mlx"
 MODEL = None
 AUTO_PASTE = True
+REUSE_SIMILAR = False
 
 keyboard_controller = Controller()
+PASTE_MODIFIER = Key.cmd if platform.system() == "Darwin" else Key.ctrl
 
-os.makedirs(TEMP_DIR, exist_ok=True)
+# Transcription runs here rather than on the keyboard listener thread, so a slow
+# backend never holds up the next hotkey. One worker keeps pastes in take order.
+transcriber = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lumi-transcribe")
 
 # Audio recording parameters
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
-CHUNK = 1024
+CHUNK = 1024  # 64 ms; the partial buffer at the stop tap is dropped, so keep this small
 
-OPTION_KEYS = (keyboard.Key.alt, keyboard.Key.alt_l, keyboard.Key.alt_r)
-CMD_KEYS = (keyboard.Key.cmd, keyboard.Key.cmd_l, keyboard.Key.cmd_r)
+OPTION_KEYS = frozenset({keyboard.Key.alt, keyboard.Key.alt_l, keyboard.Key.alt_r})
+CMD_KEYS = frozenset({keyboard.Key.cmd, keyboard.Key.cmd_l, keyboard.Key.cmd_r})
+TAP_KEYS = OPTION_KEYS | CMD_KEYS
 
 # State tracking
 recording = False
 last_option_press_time = 0
 last_cmd_press_time = 0
-frames = []
 stream = None
 audio = None
 
+# The current take streams straight into its wav from PortAudio's callback thread
+take_lock = threading.Lock()
+take_file = None
+take_writer = None
+take_peak = 0  # Loudest sample so far; a dead mic stream stays at 0
+
 
 def setup_audio():
     """Set up PyAudio and handle any device changes."""
@@ -77,31 +88,27 @@ def setup_audio():
 
 def get_default_input_device():
     """Get the input device, walking PREFERRED_MICS in order before the system default."""
-    inputs = [
-        (i, audio.get_device_info_by_index(i)["name"])
-        for i in range(audio.get_device_count())
-        if audio.get_device_info_by_index(i)["maxInputChannels"] > 0
-    ]
+    devices = [audio.get_device_info_by_index(i) for i in range(audio.get_device_count())]
+    inputs = [(i, info["name"]) for i, info in enumerate(devices) if info["maxInputChannels"] > 0]
     for preferred in PREFERRED_MICS:
         for i, name in inputs:
             if preferred in name.lower():
-                logger.info(f"Found preferred microphone: {name}")
+                logger.info("Found preferred microphone: %s", name)
                 return i
 
     try:
         info = audio.get_default_input_device_info()
-        logger.info(f"Using system default input device: {info['name']}")
+        logger.info("Using system default input device: %s", info["name"])
         return info["index"]
     except Exception as e:
-        logger.error(f"Error getting default device: {e}")
-        logger.debug(f"Stack trace: {traceback.format_exc()}")
+        logger.error("Error getting default device: %s", e)
+        logger.debug("Stack trace:", exc_info=True)
 
         # Last resort: first available input device
-        for i in range(audio.get_device_count()):
-            info = audio.get_device_info_by_index(i)
-            if info["maxInputChannels"] > 0:
-                logger.info(f"Using fallback input device: {info['name']}")
-                return i
+        if inputs:
+            i, name = inputs[0]
+            logger.info("Using fallback input device: %s", name)
+            return i
 
         raise Exception("No input devices found") from None
 
@@ -122,7 +129,46 @@ def notify(message: str) -> None:
             timeout=5,
         )
     except Exception as e:
-        logger.debug(f"Notification failed: {e}")
+        logger.debug("Notification failed: %s", e)
+
+
+def _open_take():
+    """Create the wav for a new take; the audio callback writes into it as samples arrive."""
+    global take_file, take_writer, take_peak
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(TEMP_DIR, f"recording_{timestamp}.wav")
+    wf = wave.open(path, "wb")
+    wf.setnchannels(CHANNELS)
+    wf.setsampwidth(audio.get_sample_size(FORMAT))
+    wf.setframerate(RATE)
+    with take_lock:
+        take_file, take_writer, take_peak = path, wf, 0
+
+
+def _close_take():
+    """Finalize the take's wav. Returns (path, frames written, peak); path is None
+    when no take was open."""
+    global take_file, take_writer
+    with take_lock:
+        path, wf, peak = take_file, take_writer, take_peak
+        take_file = take_writer = None
+    if wf is None:
+        return None, 0, peak
+    n_frames = wf.tell()
+    wf.close()  # patches the RIFF header with the final length
+    return path, n_frames, peak
+
+
+def _on_audio(in_data, frame_count, time_info, status):
+    """PortAudio stream callback: append the buffer to the take's wav."""
+    global take_peak
+    with take_lock:
+        if recording and take_writer is not None and in_data:
+            take_writer.writeframesraw(in_data)
+            buffer_peak = int(np.abs(np.frombuffer(in_data, dtype=np.int16)).max())
+            take_peak = max(take_peak, buffer_peak)
+    return (None, pyaudio.paContinue)
 
 
 def _kill_if_silent():
@@ -131,13 +177,14 @@ def _kill_if_silent():
     stop_recording's own silence guard then handles the user-facing part
     (notification, kept wav, no transcription).
     """
-    local_frames = list(frames)
-    if not recording or not local_frames:
+    with take_lock:
+        captured = take_writer.tell() if take_writer is not None else 0
+        peak = take_peak
+    if not recording or not captured:
         return
-    peak = int(np.abs(np.frombuffer(b"".join(local_frames), dtype=np.int16)).max())
     if peak < SILENT_PEAK:
         logger.error(
-            f"Mic delivered only silence {EARLY_SILENCE_CHECK_S}s in — stopping the recording"
+            "Mic delivered only silence %ss in — stopping the recording", EARLY_SILENCE_CHECK_S
         )
         stop_recording()
 
@@ -150,39 +197,38 @@ def play_sound(is_start=True):
         sound_path = os.path.join(script_dir, sound_file)
 
         if not os.path.exists(sound_path):
-            logger.warning(f"Sound file not found: {sound_path}")
+            logger.warning("Sound file not found: %s", sound_path)
             return
 
         play(sound_path, async_mode=True, loop=False)
     except Exception as e:
-        logger.error(f"Error playing sound: {e}")
-        logger.debug(f"Stack trace: {traceback.format_exc()}")
+        logger.error("Error playing sound: %s", e)
+        logger.debug("Stack trace:", exc_info=True)
 
 
 def start_recording():
     """Start recording audio from the microphone."""
-    global recording, stream, frames, audio
+    global recording, stream, audio
 
     if recording:
         logger.info("Already recording, ignoring start request")
         return
 
     try:
-        # Always reinitialize audio to pick up device changes
-        setup_audio()
-
         play_sound(is_start=True)
-        time.sleep(0.5)  # Needed, otherwise the start sound does not play
-
-        frames = []
+        sound_started = time.monotonic()
 
+        # Always reinitialize audio to pick up device changes. Done while the
+        # start sound plays, so device setup costs no extra wait.
+        setup_audio()
         device_index = get_default_input_device()
-        logger.info(f"Using input device index: {device_index}")
+        logger.info("Using input device index: %s", device_index)
 
-        def callback(in_data, frame_count, time_info, status):
-            if recording:
-                frames.append(in_data)
-            return (None, pyaudio.paContinue)
+        remaining = START_SOUND_S - (time.monotonic() - sound_started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+        _open_take()
 
         # Set before the stream starts so the callback keeps the first buffers
         recording = True
@@ -194,7 +240,7 @@ def start_recording():
             input=True,
             input_device_index=device_index,
             frames_per_buffer=CHUNK,
-            stream_callback=callback,
+            stream_callback=_on_audio,
         )
 
         stream.start_stream()
@@ -202,8 +248,8 @@ def start_recording():
         logger.info("Recording started...")
 
     except Exception as e:
-        logger.error(f"Error starting recording: {e}")
-        logger.debug(f"Stack trace: {traceback.format_exc()}")
+        logger.error("Error starting recording: %s", e)
+        logger.debug("Stack trace:", exc_info=True)
         recording = False
 
         if stream:
@@ -213,82 +259,98 @@ def start_recording():
                 pass
             stream = None
 
+        path, _, _ = _close_take()
+        if path:
+            os.remove(path)
+
         setup_audio()
 
 
 def stop_recording():
-    """Stop recording, transcribe the audio, and paste the result.
+    """Stop recording and queue the take for transcription and pasting.
 
     Recordings are kept in the system temp directory for troubleshooting;
     the OS cleans them up eventually.
     """
-    global recording, stream, frames
+    global recording, stream
 
     if not recording:
         return
 
-    recording = False
-    local_frames = list(frames)
-    frames = []
-
     try:
         if stream:
-            stream.stop_stream()
-            stream.close()
-            stream = None
+            # Stop before clearing `recording`: _on_audio keeps the buffers PortAudio
+            # delivers while the stream winds down.
+            active, stream = stream, None
+            active.stop_stream()
+            active.close()
+        recording = False
 
+        temp_file, n_frames, peak = _close_take()
         play_sound(is_start=False)
         logger.info("Recording stopped.")
 
-        if not local_frames:
+        if not n_frames:
+            if temp_file:
+                os.remove(temp_file)
             return
 
-        timestamp = time.strftime("%Y%m%d-%H%M%S")
-        temp_file = os.path.join(TEMP_DIR, f"recording_{timestamp}.wav")
+        logger.info("Recording saved to %s", temp_file)
 
-        raw = b"".join(local_frames)
-        with wave.open(temp_file, "wb") as wf:
-            wf.setnchannels(CHANNELS)
-            wf.setsampwidth(audio.get_sample_size(FORMAT))
-            wf.setframerate(RATE)
-            wf.writeframes(raw)
-
-        logger.info(f"Recording saved to {temp_file}")
-
-        peak = int(np.abs(np.frombuffer(raw, dtype=np.int16)).max())
         if peak < SILENT_PEAK:
             logger.error(
-                f"Recording is silent (peak {peak}) — the mic delivered no signal. "
-                f"Check the input device (idle Bluetooth mics record zeros). Kept {temp_file}"
+                "Recording is silent (peak %d) — the mic delivered no signal. "
+                "Check the input device (idle Bluetooth mics record zeros). Kept %s",
+                peak,
+                temp_file,
             )
             notify("Recording was silent — the mic delivered nothing. Check input device.")
             return
 
-        transcribe_and_paste(temp_file)
+        transcriber.submit(transcribe_and_paste, temp_file)
 
     except Exception as e:
-        logger.error(f"Error stopping recording: {e}")
-        logger.debug(f"Stack trace: {traceback.format_exc()}")
+        logger.error("Error stopping recording: %s", e)
+        logger.debug("Stack trace:", exc_info=True)
 
     finally:
         recording = False
+        _close_take()  # no-op unless a failed stop left the take open
 
 
-def transcribe_and_paste(audio_file):
-    """Transcribe a wav and deliver the text: clipboard, then paste."""
-    transcript = transcribe(audio_file, service=SERVICE, model=MODEL)
-    if transcript:
-        pyperclip.copy(transcript)
-        logger.info(f"Transcript copied to clipboard: {transcript}")
-        if AUTO_PASTE:
-            auto_paste()
-    else:
-        logger.warning("Transcription came back empty — nothing to paste")
-        notify("Transcription came back empty.")
+def transcribe_and_paste(audio_file, use_cache=True):
+    """Transcribe a wav and deliver the text: clipboard, then paste.
+
+    Runs on the transcriber thread, where nobody would see an exception, so
+    errors are logged here.
+    """
+    try:
+        transcript = transcribe(
+            audio_file,
+            service=SERVICE,
+            model=MODEL,
+            reuse_similar=REUSE_SIMILAR,
+            use_cache=use_cache,
+        )
+        if transcript:
+            pyperclip.copy(transcript)
+            logger.info("Transcript copied to clipboard: %s", transcript)
+            if AUTO_PASTE:
+                auto_paste()
+        else:
+            logger.warning("Transcription came back empty — nothing to paste")
+            notify("Transcription came back empty.")
+    except Exception as e:
+        logger.error("Error delivering transcript: %s", e)
+        logger.debug("Stack trace:", exc_info=True)
 
 
 def resend_last_recording():
-    """Re-transcribe the newest saved recording and paste the result."""
+    """Re-transcribe the newest saved recording and paste the result.
+
+    Bypasses the transcript caches: a resend is a retry, e.g. after switching
+    the server's model, so the earlier text is exactly what it must not return.
+    """
     wavs = glob.glob(os.path.join(TEMP_DIR, "recording_*.wav"))
     if not wavs:
         logger.warning("No saved recordings to resend")
@@ -296,9 +358,9 @@ def resend_last_recording():
         return
 
     latest = max(wavs, key=os.path.getmtime)
-    logger.info(f"Resending {latest}")
+    logger.info("Resending %s", latest)
     play_sound(is_start=True)
-    transcribe_and_paste(latest)
+    transcriber.submit(transcribe_and_paste, latest, use_cache=False)
 
 
 def on_press(key):
@@ -307,8 +369,15 @@ def on_press(key):
     in between means the modifier was part of a chord, not a tap."""
     global last_option_press_time, last_cmd_press_time, recording
 
+    # Runs for every keystroke system-wide: keep the common case cheap
+    if key not in TAP_KEYS:
+        last_option_press_time = 0
+        last_cmd_press_time = 0
+        return
+
+    current_time = time.monotonic()
+
     if key in OPTION_KEYS:
-        current_time = time.time()
         time_diff = current_time - last_option_press_time
         last_cmd_press_time = 0
 
@@ -324,8 +393,7 @@ def on_press(key):
         else:
             last_option_press_time = current_time
 
-    elif key in CMD_KEYS:
-        current_time = time.time()
+    else:
         time_diff = current_time - last_cmd_press_time
         last_option_press_time = 0
 
@@ -338,31 +406,23 @@ def on_press(key):
         else:
             last_cmd_press_time = current_time
 
-    else:
-        last_option_press_time = 0
-        last_cmd_press_time = 0
-
 
 def auto_paste():
     """Paste the clipboard content with the platform's paste shortcut."""
     try:
-        time.sleep(0.5)  # Ensure the clipboard is ready
-
-        modifier = Key.cmd if platform.system() == "Darwin" else Key.ctrl
-        keyboard_controller.press(modifier)
-        keyboard_controller.press("v")
-        keyboard_controller.release("v")
-        keyboard_controller.release(modifier)
+        # No settle delay needed: pyperclip.copy only returns once pbcopy has exited
+        with keyboard_controller.pressed(PASTE_MODIFIER):
+            keyboard_controller.tap("v")
 
         logger.info("Auto-paste completed")
     except Exception as e:
-        logger.error(f"Error during auto-paste: {e}")
-        logger.debug(f"Stack trace: {traceback.format_exc()}")
+        logger.error("Error during auto-paste: %s", e)
+        logger.debug("Stack trace:", exc_info=True)
 
 
 def main():
     """Entry point for the lumi command."""
-    global SERVICE, MODEL, AUTO_PASTE, audio
+    global SERVICE, MODEL, AUTO_PASTE, REUSE_SIMILAR, audio
 
     parser = argparse.ArgumentParser(description="Lumi Speech-to-Text")
     parser.add_argument("file", nargs="?", help="Audio file to transcribe (optional)")
@@ -376,12 +436,23 @@ def main():
     parser.add_argument(
         "--no-auto-paste", action="store_true", help="Disable automatic pasting of transcription"
     )
+    parser.add_argument(
+        "--reuse-similar",
+        action="store_true",
+        help="Paste the earlier transcript when a take sounds like a recent one (repeated phrases)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore cached transcripts and transcribe the file again",
+    )
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
     args = parser.parse_args()
 
     SERVICE = args.service
     MODEL = args.model
     AUTO_PASTE = not args.no_auto_paste
+    REUSE_SIMILAR = args.reuse_similar
 
     if args.debug:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -390,9 +461,11 @@ def main():
     # One-off file transcription mode
     if args.file:
         if not os.path.exists(args.file):
-            logger.error(f"File not found: {args.file}")
+            logger.error("File not found: %s", args.file)
             return
-        transcript = transcribe(args.file, service=SERVICE, model=MODEL)
+        transcript = transcribe(
+            args.file, service=SERVICE, model=MODEL, use_cache=not args.no_cache
+        )
         print(transcript)
         pyperclip.copy(transcript)
         logger.info("Transcript copied to clipboard")
@@ -401,20 +474,22 @@ def main():
     keyboard_listener = None
     try:
         setup_audio()
+        threading.Thread(target=preload, args=(SERVICE, MODEL), daemon=True).start()
 
         keyboard_listener = keyboard.Listener(on_press=on_press)
         keyboard_listener.start()
 
         logger.info("Speech-to-text service started.")
-        logger.info(f"Using {SERVICE} transcription service.")
+        logger.info("Using %s transcription service.", SERVICE)
         logger.info("Double-tap the Option key to START recording.")
         logger.info("Single-tap the Option key to STOP recording.")
         if AUTO_PASTE:
             logger.info("Auto-paste is enabled - transcriptions will be automatically pasted.")
         logger.info("Press Ctrl+C in this terminal to exit.")
 
-        while True:
-            time.sleep(1)
+        # Sleeps until the listener thread ends; Ctrl+C interrupts the join.
+        keyboard_listener.join()
+        logger.warning("Keyboard listener stopped — exiting")
 
     except KeyboardInterrupt:
         logger.info("Exiting speech-to-text service...")
@@ -426,11 +501,13 @@ def main():
         if recording:
             stop_recording()
 
+        transcriber.shutdown(wait=True)  # deliver takes still being transcribed
+
         if audio is not None:
             try:
                 audio.terminate()
             except Exception as e:
-                logger.error(f"Error terminating audio: {e}")
+                logger.error("Error terminating audio: %s", e)
             audio = None
 
 
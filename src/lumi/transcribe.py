@@ -1,52 +1,214 @@
 """Transcription backends: local MLX Whisper and a self-hosted remote ASR server."""
 
+import collections
+import functools
+import hashlib
+import json
 import logging
 import os
 import tempfile
-import traceback
+import threading
 
-import requests
+import numpy as np
 
 from lumi import audio as audio_prep
 
 logger = logging.getLogger(__name__)
 
-SERVICES = ("mlx", "remote")
-
 DEFAULT_MLX_MODEL = "mlx-community/whisper-large-v3-turbo"
 DEFAULT_REMOTE_URL = "http://nel:8010"
 
+# Transcripts of earlier recordings, keyed by content hash, so a repeated
+# transcription (resend, the same file on the CLI) skips the backend entirely.
+CACHE_FILE = os.path.join(tempfile.gettempdir(), "speech_to_text", "cache.json")
+CACHE_SIZE = 128  # entries kept; least recently used are dropped first
+
+_cache: dict[str, str] | None = None  # loaded from CACHE_FILE on first use
+
+# Opt-in second tier: spectral fingerprints of recent takes, so saying the same
+# thing again reuses its transcript. In memory only.
+SIMILAR_CACHE_SIZE = 64
+# fingerprint_distance cutoff. Calibrated only on synthetic multi-tone phrases (repeats
+# ~0.01-0.04, different phrases >0.15), not on recorded speech.
+SIMILAR_MAX_DISTANCE = 0.08
+SIMILAR_MAX_LENGTH_RATIO = 1.25  # takes whose lengths differ more than this never match
+# Recordings longer than this (pauses included) are dictation, not a repeated phrase:
+# they are never fingerprinted, which keeps long takes off the full-spectrum arrays.
+SIMILAR_MAX_TAKE_S = 10.0
+
+# (service, model, duration in s, fingerprint, transcript), most recently used last
+_similar = collections.deque(maxlen=SIMILAR_CACHE_SIZE)
 
-def transcribe(audio_file: str, service: str = "mlx", model: str | None = None) -> str:
+# mlx_whisper holds the loaded model in a class-level singleton; serialize use so
+# a preload and the first recording don't both load it.
+_mlx_lock = threading.Lock()
+
+
+def transcribe(
+    audio_file: str,
+    service: str = "mlx",
+    model: str | None = None,
+    reuse_similar: bool = False,
+    use_cache: bool = True,
+) -> str:
     """Transcribe an audio file. Returns the text, or an error marker string on failure.
 
     Args:
         audio_file: Path to the audio file.
         service: "mlx" (local Whisper) or "remote" (self-hosted ASR server).
         model: MLX model name; falls back to MLX_WHISPER_MODEL env var, then the default.
+        reuse_similar: Return the transcript of a recent take that sounds the same
+            (a repeated phrase) instead of transcribing again.
+        use_cache: Look up earlier transcripts first. With False the backend always
+            runs (a deliberate retry); its result still refreshes the cache.
     """
-    if not os.path.exists(audio_file):
-        logger.error(f"Audio file not found: {audio_file}")
+    try:
+        size = os.stat(audio_file).st_size
+    except (FileNotFoundError, NotADirectoryError):
+        logger.error("Audio file not found: %s", audio_file)
         return "[Transcription error: File not found]"
-    if os.path.getsize(audio_file) == 0:
+    except OSError as e:
+        logger.error("Cannot access audio file %s: %s", audio_file, e)
+        return f"[Transcription error: {e}]"
+    if size == 0:
         logger.error("Audio file is empty")
         return "[Transcription error: File is empty]"
 
     try:
-        audio_file = _gate_silences_to_temp(audio_file)
-        if service == "mlx":
-            return _transcribe_mlx(audio_file, model)
-        elif service == "remote":
-            return _transcribe_remote(audio_file)
-        raise ValueError(f"Unknown service: {service} (options: {', '.join(SERVICES)})")
+        key = _cache_key(audio_file, service, model)
+    except OSError as e:
+        logger.debug("Cache skipped: %s", e)  # unreadable; the backend reports the error
+        key = None
+    cached = _cache_get(key) if use_cache and key is not None else None
+    if cached is not None:
+        logger.info("Cache hit — reusing the earlier transcript")
+        return cached
+
+    take = _fingerprint_file(audio_file) if reuse_similar else None
+    if take is not None and use_cache:
+        similar = _similar_get(service, model, *take)
+        if similar is not None:
+            logger.info("Sounds like a recent take — reusing its transcript")
+            return similar
+
+    try:
+        backend = _BACKENDS.get(service)
+        if backend is None:
+            raise ValueError(f"Unknown service: {service} (options: {', '.join(SERVICES)})")
+        gated_file = _gate_silences_to_temp(audio_file)
+        try:
+            text = backend(gated_file, model)
+        finally:
+            if gated_file != audio_file:
+                _remove_quietly(gated_file)
     except Exception as e:
-        logger.error(f"Error during {service} transcription: {e}")
-        logger.debug(f"Stack trace: {traceback.format_exc()}")
+        logger.error("Error during %s transcription: %s", service, e)
+        logger.debug("Stack trace:", exc_info=True)
         return f"[Transcription error: {e}]"
 
+    if text and key is not None:
+        _cache_put(key, text)
+        if take is not None:
+            _similar.append((service, model, *take, text))
+    return text
+
+
+def _cache_key(audio_file: str, service: str, model: str | None) -> str:
+    """Hash of the recording's bytes plus the backend settings that produced the text.
+
+    Settings are resolved as the backend resolves them, so changing
+    MLX_WHISPER_MODEL or LUMI_REMOTE_URL doesn't return the old backend's text.
+    """
+    if service == "mlx":
+        settings = _mlx_model(model)
+    elif service == "remote":
+        settings = _remote_url()
+    else:
+        settings = model or ""
+    with open(audio_file, "rb") as f:
+        # Hashes through one reused buffer rather than reading the whole file into memory
+        digest = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16))
+    digest.update(f"\0{service}\0{settings}".encode())
+    return digest.hexdigest()
+
+
+def _load_cache() -> dict[str, str]:
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE) as f:
+                _cache = dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            _cache = {}
+    return _cache
+
+
+def _cache_get(key: str) -> str | None:
+    cache = _load_cache()
+    text = cache.pop(key, None)
+    if text is not None:
+        cache[key] = text  # re-insert: dict order doubles as recency order
+    return text
+
+
+def _cache_put(key: str, text: str) -> None:
+    """Store a transcript and persist the cache. Best-effort: a failed write only
+    costs the cache, never the transcription."""
+    cache = _load_cache()
+    cache.pop(key, None)
+    cache[key] = text
+    while len(cache) > CACHE_SIZE:
+        del cache[next(iter(cache))]
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_file = f"{CACHE_FILE}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, CACHE_FILE)
+    except OSError as e:
+        logger.warning("Could not save transcript cache: %s", e)
+
+
+def _fingerprint_file(audio_file: str) -> tuple[float, np.ndarray] | None:
+    """(gated duration in s, fingerprint) of a recording; None if it can't be
+    fingerprinted or is longer than SIMILAR_MAX_TAKE_S. Gated first, so pauses
+    before and after don't count."""
+    try:
+        if audio_prep.wav_duration(audio_file) > SIMILAR_MAX_TAKE_S:
+            return None
+        samples, rate = audio_prep.load_wav(audio_file)
+        gated = audio_prep.gate_silences(samples, rate)
+        fp = audio_prep.fingerprint(gated, rate)
+    except Exception as e:
+        logger.debug("Fingerprint skipped: %s", e)
+        return None
+    return None if fp is None else (len(gated) / rate, fp)
+
+
+def _similar_get(service: str, model: str | None, duration: float, fp: np.ndarray) -> str | None:
+    """Transcript of the closest recent take within SIMILAR_MAX_DISTANCE, if any."""
+    best, best_distance = None, SIMILAR_MAX_DISTANCE
+    for i, (e_service, e_model, e_duration, e_fp, _) in enumerate(_similar):
+        if (e_service, e_model) != (service, model):
+            continue
+        if max(duration, e_duration) > SIMILAR_MAX_LENGTH_RATIO * min(duration, e_duration):
+            continue
+        distance = audio_prep.fingerprint_distance(fp, e_fp)
+        logger.debug("Fingerprint distance to earlier take: %.3f", distance)
+        if distance <= best_distance:
+            best, best_distance = i, distance
+    if best is None:
+        return None
+    # By index: entries hold numpy arrays, so deque.remove's == comparison can't be used
+    entry = _similar[best]
+    del _similar[best]
+    _similar.append(entry)
+    return entry[-1]
+
 
 def _gate_silences_to_temp(audio_file: str) -> str:
-    """Collapse long silences; returns a gated temp copy, or the original on failure.
+    """Collapse long silences; returns a gated temp copy (the caller removes it), or
+    the original when nothing changed or on failure.
 
     Best-effort: a recording that can't be preprocessed (odd format) is
     transcribed as-is rather than failing.
@@ -59,64 +221,105 @@ def _gate_silences_to_temp(audio_file: str) -> str:
         fd, gated_file = tempfile.mkstemp(suffix=".wav", prefix="lumi_gated_")
         os.close(fd)
         audio_prep.save_wav(gated_file, gated, rate)
-        logger.debug(f"Silence gating: {len(samples) / rate:.1f}s -> {len(gated) / rate:.1f}s")
+        logger.debug("Silence gating: %.1fs -> %.1fs", len(samples) / rate, len(gated) / rate)
         return gated_file
     except Exception as e:
-        logger.warning(f"Silence gating skipped: {e}")
+        logger.warning("Silence gating skipped: %s", e)
         return audio_file
 
 
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.debug("Could not remove %s: %s", path, e)
+
+
+def preload(service: str, model: str | None = None) -> None:
+    """Load the backend's model ahead of the first recording. Best-effort.
+
+    mlx_whisper keeps the last model it loaded and reuses it on later calls,
+    so only the very first transcription pays the load (seconds; longer when
+    the weights still have to be downloaded). Transcribing a second of silence
+    here moves that cost to startup. The remote backend has nothing to load.
+    """
+    if service != "mlx":
+        return
+    try:
+        import mlx_whisper
+
+        model = _mlx_model(model)
+        with _mlx_lock:
+            mlx_whisper.transcribe(np.zeros(16000, dtype=np.float32), path_or_hf_repo=model)
+        logger.info("MLX Whisper model %s loaded", model)
+    except Exception as e:
+        logger.warning("Model preload failed, loading on first use instead: %s", e)
+
+
+def _mlx_model(model: str | None) -> str:
+    return model or os.environ.get("MLX_WHISPER_MODEL", DEFAULT_MLX_MODEL)
+
+
+def _remote_url() -> str:
+    return os.environ.get("LUMI_REMOTE_URL", DEFAULT_REMOTE_URL)
+
+
 def _transcribe_mlx(audio_file: str, model: str | None) -> str:
     import mlx_whisper  # deferred: importing mlx is slow and remote mode doesn't need it
 
-    model = model or os.environ.get("MLX_WHISPER_MODEL", DEFAULT_MLX_MODEL)
-    logger.debug(f"Transcribing {audio_file} with MLX Whisper model {model}")
-    result = mlx_whisper.transcribe(audio_file, path_or_hf_repo=model)
+    model = _mlx_model(model)
+    logger.debug("Transcribing %s with MLX Whisper model %s", audio_file, model)
+    with _mlx_lock:
+        result = mlx_whisper.transcribe(audio_file, path_or_hf_repo=model)
     return result["text"]
 
 
-def _transcribe_remote(audio_file: str) -> str:
+def _transcribe_remote(audio_file: str, model: str | None = None) -> str:
     """POST to the remote server, splitting long audio into chunks the server's
     models can take in one forward pass (~30s windows) and sending them all in
-    a single batch request."""
-    base_url = os.environ.get("LUMI_REMOTE_URL", DEFAULT_REMOTE_URL)
+    a single batch request. The server picks its own model; `model` is unused."""
+    base_url = _remote_url()
 
     try:
         samples, rate = audio_prep.load_wav(audio_file)
     except Exception as e:
         # Not a plain mono WAV (e.g. an mp3 passed on the CLI): send as-is,
         # the server decodes other formats itself.
-        logger.debug(f"Chunking skipped ({e}); sending {audio_file} whole")
+        logger.debug("Chunking skipped (%s); sending %s whole", e, audio_file)
         return _post_single(base_url, audio_file)
 
     chunks = audio_prep.split_at_silences(samples, rate)
-    logger.debug(f"Sending {audio_file} to {base_url} in {len(chunks)} chunk(s)")
+    logger.debug("Sending %s to %s in %d chunk(s)", audio_file, base_url, len(chunks))
     if len(chunks) == 1:
         return _post_single(base_url, audio_file)
 
-    chunk_files = []
-    try:
-        for i, chunk in enumerate(chunks):
-            fd, chunk_file = tempfile.mkstemp(suffix=".wav", prefix=f"lumi_chunk{i}_")
-            os.close(fd)
-            audio_prep.save_wav(chunk_file, chunk, rate)
-            chunk_files.append(chunk_file)
-        files = [
-            ("files", (os.path.basename(p), open(p, "rb").read(), "audio/wav")) for p in chunk_files
-        ]
-    finally:
-        for p in chunk_files:
-            os.unlink(p)
-
-    response = requests.post(f"{base_url}/transcribe_batch", files=files, timeout=300)
+    files = [
+        ("files", (f"chunk{i}.wav", audio_prep.wav_bytes(chunk, rate), "audio/wav"))
+        for i, chunk in enumerate(chunks)
+    ]
+    response = _http_session().post(f"{base_url}/transcribe_batch", files=files, timeout=300)
     response.raise_for_status()
     texts = response.json().get("texts", [])
     return " ".join(t.strip() for t in texts if t.strip())
 
 
+@functools.cache
+def _http_session():
+    """Process-wide HTTP session, so consecutive takes reuse the open connection
+    to the server instead of reconnecting each time."""
+    import requests  # deferred: ~100 ms to import and the default mlx mode doesn't need it
+
+    return requests.Session()
+
+
 def _post_single(base_url: str, audio_file: str) -> str:
     with open(audio_file, "rb") as audio:
         files = {"file": (os.path.basename(audio_file), audio, "audio/wav")}
-        response = requests.post(f"{base_url}/transcribe", files=files, timeout=300)
+        response = _http_session().post(f"{base_url}/transcribe", files=files, timeout=300)
     response.raise_for_status()
     return response.json().get("text", "")
+
+
+# Backends take (audio_file, model) and return the transcript
+_BACKENDS = {"mlx": _transcribe_mlx, "remote": _transcribe_remote}
+SERVICES = tuple(_BACKENDS)
@@ -0,0 +1,19 @@
+"""Speech-like synthetic signals shared by the fingerprint and similar-take tests."""
+
+import numpy as np
+
+RATE = 16000
+
+# Formant triples, one per syllable
+PHRASE_A = [(300, 900, 2500), (500, 1500, 2200), (250, 700, 3000), (400, 1200, 2600)]
+PHRASE_B = [(600, 1700, 2400), (350, 800, 2900), (450, 1100, 2000), (300, 2300, 3100)]
+
+
+def phrase(formants, syllable_s=0.25, noise=200, seed=0):
+    """One enveloped multi-tone burst per syllable, plus noise, as int16 at RATE."""
+    t = np.arange(int(syllable_s * RATE)) / RATE
+    envelope = np.exp(-(((t - syllable_s / 2) / (syllable_s / 4)) ** 2))
+    bursts = [sum(np.sin(2 * np.pi * f * t) for f in freqs) * envelope for freqs in formants]
+    rng = np.random.default_rng(seed)
+    signal = 3000 * np.concatenate(bursts)
+    return (signal + noise * rng.standard_normal(len(signal))).astype(np.int16)
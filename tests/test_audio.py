@@ -2,11 +2,10 @@
 
 import numpy as np
 import pytest
+from speech import PHRASE_A, PHRASE_B, RATE, phrase
 
 from lumi import audio
 
-RATE = 16000
-
 
 def tone(seconds: float, amplitude: int = 8000) -> np.ndarray:
     t = np.arange(int(seconds * RATE)) / RATE
@@ -90,3 +89,40 @@ def test_split_cuts_in_silence():
     assert len(chunks) == 2
     cut = len(chunks[0])
     assert 20.0 * RATE <= cut <= 21.0 * RATE
+
+
+def test_wav_bytes_matches_file(tmp_path):
+    samples = tone(0.5)
+    path = tmp_path / "t.wav"
+    audio.save_wav(str(path), samples, RATE)
+    assert audio.wav_bytes(samples, RATE) == path.read_bytes()
+
+
+def test_gate_trims_edge_silence():
+    samples = np.concatenate([silence(0.7), tone(2.0), silence(0.6)])
+    gated = audio.gate_silences(samples, RATE)
+    # Edge silence is trimmed to KEPT_SILENCE_S even below MAX_SILENCE_S...
+    expected = audio.KEPT_SILENCE_S + 2.0 + audio.KEPT_SILENCE_S
+    assert len(gated) / RATE == pytest.approx(expected, abs=0.05)
+    # ...keeping the silence next to the speech, so the speech is intact.
+    start = int(audio.KEPT_SILENCE_S * RATE)
+    assert np.count_nonzero(gated[: start - 480]) == 0
+    assert np.count_nonzero(gated[start + 480 : start + 2 * RATE - 480]) > 0
+
+
+def test_fingerprint_matches_a_repeat():
+    original = audio.fingerprint(phrase(PHRASE_A), RATE)
+    # Said again: a bit faster, noisier, through a different gain.
+    repeat = audio.fingerprint((phrase(PHRASE_A, 0.21, noise=500, seed=1) * 0.5), RATE)
+    assert audio.fingerprint_distance(original, repeat) < 0.05
+
+
+def test_fingerprint_separates_different_phrases():
+    a = audio.fingerprint(phrase(PHRASE_A), RATE)
+    b = audio.fingerprint(phrase(PHRASE_B), RATE)
+    assert audio.fingerprint_distance(a, b) > 0.3
+    assert audio.fingerprint_distance(a, a) == pytest.approx(0, abs=1e-9)
+
+
+def test_fingerprint_too_short():
+    assert audio.fingerprint(tone(0.05), RATE) is None
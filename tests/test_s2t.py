@@ -1,9 +1,20 @@
 import os
-from unittest.mock import MagicMock, patch
+from unittest.mock import Mock, call, patch
 
 import numpy as np
+import pytest
 
-from lumi import s2t
+from lumi import audio, s2t
+
+
+def _drain_transcriber():
+    """Wait for queued transcriptions; the single worker runs jobs in order."""
+    s2t.transcriber.submit(lambda: None).result()
+
+
+def _by_name(keys):
+    """Stable parametrization order and readable ids for a set of pynput keys."""
+    return pytest.mark.parametrize("key", sorted(keys, key=lambda k: k.name), ids=lambda k: k.name)
 
 
 def _reset_tap_state():
@@ -12,13 +23,30 @@ def _reset_tap_state():
     s2t.last_cmd_press_time = 0
 
 
-def _run_stop_recording(frames):
-    """Drive stop_recording with the given captured frames; returns the transcribe mock."""
-    s2t.recording = True
-    s2t.frames = frames
+@pytest.fixture
+def take_dir(tmp_path, monkeypatch):
+    """Recordings go to a per-test directory; any take left open is closed afterwards."""
+    monkeypatch.setattr(s2t, "TEMP_DIR", str(tmp_path))
     s2t.stream = None
-    s2t.audio = MagicMock()
+    s2t.audio = Mock(spec=s2t.pyaudio.PyAudio)
     s2t.audio.get_sample_size.return_value = 2
+    yield tmp_path
+    s2t.recording = False
+    s2t.stream = None
+    s2t._close_take()
+
+
+def _record(buffers):
+    """Open a take and feed buffers through the stream callback, as PortAudio would."""
+    s2t._open_take()
+    s2t.recording = True
+    for buffer in buffers:
+        s2t._on_audio(buffer, len(buffer) // 2, None, 0)
+
+
+def _run_stop_recording(buffers):
+    """Record the given buffers, then stop; returns the transcribe and notify mocks."""
+    _record(buffers)
     with (
         patch.object(s2t, "play_sound"),
         patch.object(s2t, "notify") as mock_notify,
@@ -27,10 +55,11 @@ def _run_stop_recording(frames):
         patch.object(s2t.pyperclip, "copy"),
     ):
         s2t.stop_recording()
+        _drain_transcriber()
     return mock_transcribe, mock_notify
 
 
-def test_silent_recording_skips_transcription():
+def test_silent_recording_skips_transcription(take_dir):
     """An all-zero capture (dead mic stream) is caught: no transcription, user notified."""
     silent = np.zeros(s2t.RATE, dtype=np.int16).tobytes()
     mock_transcribe, mock_notify = _run_stop_recording([silent])
@@ -38,7 +67,7 @@ def test_silent_recording_skips_transcription():
     mock_notify.assert_called_once()
 
 
-def test_loud_recording_is_transcribed():
+def test_loud_recording_is_transcribed(take_dir):
     """A capture with real signal goes through to transcription."""
     loud = (np.ones(s2t.RATE, dtype=np.int16) * 5000).tobytes()
     mock_transcribe, mock_notify = _run_stop_recording([loud])
@@ -46,36 +75,77 @@ def test_loud_recording_is_transcribed():
     mock_notify.assert_not_called()
 
 
+def test_take_streams_into_wav(take_dir):
+    """Buffers from the callback end up, in order, in a valid wav."""
+    samples = np.arange(-4000, 4000, dtype=np.int16)
+    buffers = [samples[:3000].tobytes(), samples[3000:].tobytes()]
+    mock_transcribe, _ = _run_stop_recording(buffers)
+    wav_path = mock_transcribe.call_args.args[0]
+    loaded, rate = audio.load_wav(wav_path)
+    assert rate == s2t.RATE
+    assert np.array_equal(loaded, samples)
+
+
+def test_buffers_delivered_while_stopping_are_kept(take_dir):
+    """A buffer PortAudio delivers during stop_stream still lands in the take."""
+    samples = np.arange(-4000, 4000, dtype=np.int16)
+    s2t.stream = Mock(spec=["stop_stream", "close"])
+    s2t.stream.stop_stream.side_effect = lambda: s2t._on_audio(
+        samples[3000:].tobytes(), len(samples) - 3000, None, 0
+    )
+    mock_transcribe, _ = _run_stop_recording([samples[:3000].tobytes()])
+    loaded, _ = audio.load_wav(mock_transcribe.call_args.args[0])
+    assert np.array_equal(loaded, samples)
+
+
+def test_failed_stream_stop_still_closes_take(take_dir):
+    """If stopping the stream raises, the take's wav is still finalized."""
+    samples = np.arange(-4000, 4000, dtype=np.int16)
+    s2t.stream = Mock(spec=["stop_stream", "close"])
+    s2t.stream.stop_stream.side_effect = OSError("device gone")
+    mock_transcribe, _ = _run_stop_recording([samples.tobytes()])
+    mock_transcribe.assert_not_called()
+    assert s2t.take_writer is None
+    (wav_path,) = take_dir.iterdir()
+    loaded, _ = audio.load_wav(str(wav_path))
+    assert np.array_equal(loaded, samples)
+
+
+def test_empty_take_leaves_no_file(take_dir):
+    """Stopping before any audio arrived removes the take's wav and transcribes nothing."""
+    mock_transcribe, _ = _run_stop_recording([])
+    mock_transcribe.assert_not_called()
+    assert not list(take_dir.iterdir())
+
+
 def test_get_default_input_device():
     """The system default input device is returned when no preferred mic exists."""
-    with patch("pyaudio.PyAudio") as mock_pyaudio:
-        mock_instance = mock_pyaudio.return_value
-        mock_instance.get_device_count.return_value = 0
-        mock_instance.get_default_input_device_info.return_value = {"index": 1, "name": "Mock Mic"}
+    s2t.audio = Mock(spec=s2t.pyaudio.PyAudio)
+    s2t.audio.get_device_count.return_value = 0
+    s2t.audio.get_default_input_device_info.return_value = {"index": 1, "name": "Mock Mic"}
+    assert s2t.get_default_input_device() == 1
+    s2t.audio.get_default_input_device_info.assert_called_once()
 
-        s2t.audio = mock_instance
-        assert s2t.get_default_input_device() == 1
-        mock_instance.get_default_input_device_info.assert_called_once()
 
-
-def test_early_silence_kills_recording():
+def test_early_silence_kills_recording(take_dir):
     """Mid-take check stops an all-zero take, leaves real takes and stopped state alone."""
     silent = np.zeros(s2t.RATE, dtype=np.int16).tobytes()
     loud = (np.ones(s2t.RATE, dtype=np.int16) * 5000).tobytes()
 
     with patch.object(s2t, "stop_recording") as mock_stop:
-        s2t.recording = True
-        s2t.frames = [silent]
+        _record([silent])
         s2t._kill_if_silent()
         mock_stop.assert_called_once()
+        s2t._close_take()
 
         mock_stop.reset_mock()
-        s2t.frames = [loud]
+        _record([loud])
         s2t._kill_if_silent()
         mock_stop.assert_not_called()
+        s2t._close_take()
 
+        _record([silent])
         s2t.recording = False
-        s2t.frames = [silent]
         s2t._kill_if_silent()
         mock_stop.assert_not_called()
 
@@ -87,33 +157,36 @@ def test_preferred_mic_order():
         {"index": 1, "name": "Some Speakers", "maxInputChannels": 0},
         {"index": 2, "name": "Zeljko's AirPods", "maxInputChannels": 1},
     ]
-    s2t.audio = MagicMock()
+    s2t.audio = Mock(spec=s2t.pyaudio.PyAudio)
     s2t.audio.get_device_count.return_value = len(devices)
     s2t.audio.get_device_info_by_index.side_effect = lambda i: devices[i]
     assert s2t.get_default_input_device() == 2
+    assert s2t.audio.get_device_info_by_index.call_count == len(devices)  # one query per device
 
 
-def test_double_tap_starts_recording():
+@_by_name(s2t.OPTION_KEYS)
+def test_double_tap_starts_recording(key):
     """Two Option presses within DOUBLE_TAP_TIME start recording."""
     _reset_tap_state()
     with (
-        patch.object(s2t.time, "time", side_effect=[100.0, 100.1]),
+        patch.object(s2t.time, "monotonic", side_effect=[100.0, 100.1]),
         patch.object(s2t, "start_recording") as mock_start,
     ):
-        s2t.on_press(s2t.keyboard.Key.alt)
-        s2t.on_press(s2t.keyboard.Key.alt)
+        s2t.on_press(key)
+        s2t.on_press(key)
     mock_start.assert_called_once()
 
 
-def test_double_tap_cmd_resends():
+@_by_name(s2t.CMD_KEYS)
+def test_double_tap_cmd_resends(key):
     """Two bare Cmd presses within DOUBLE_TAP_TIME resend the last recording."""
     _reset_tap_state()
     with (
-        patch.object(s2t.time, "time", side_effect=[100.0, 100.1]),
+        patch.object(s2t.time, "monotonic", side_effect=[100.0, 100.1]),
         patch.object(s2t, "resend_last_recording") as mock_resend,
     ):
-        s2t.on_press(s2t.keyboard.Key.cmd)
-        s2t.on_press(s2t.keyboard.Key.cmd)
+        s2t.on_press(key)
+        s2t.on_press(key)
     mock_resend.assert_called_once()
 
 
@@ -121,7 +194,7 @@ def test_cmd_chords_do_not_resend():
     """Cmd+key chords (e.g. fast cmd+c cmd+v) never count as a double-tap."""
     _reset_tap_state()
     with (
-        patch.object(s2t.time, "time", side_effect=[100.0, 100.2]),
+        patch.object(s2t.time, "monotonic", side_effect=[100.0, 100.2]),
         patch.object(s2t, "resend_last_recording") as mock_resend,
     ):
         s2t.on_press(s2t.keyboard.Key.cmd)
@@ -145,7 +218,7 @@ def test_cmd_double_tap_ignored_while_recording():
 
 
 def test_resend_picks_latest_recording(tmp_path, monkeypatch):
-    """Resend transcribes the newest wav in TEMP_DIR."""
+    """Resend transcribes the newest wav in TEMP_DIR afresh, past the caches."""
     monkeypatch.setattr(s2t, "TEMP_DIR", str(tmp_path))
     old = tmp_path / "recording_20260719-100000.wav"
     new = tmp_path / "recording_20260719-200000.wav"
@@ -161,8 +234,10 @@ def test_resend_picks_latest_recording(tmp_path, monkeypatch):
         patch.object(s2t.pyperclip, "copy"),
     ):
         s2t.resend_last_recording()
+        _drain_transcriber()
 
-    assert mock_transcribe.call_args[0][0] == str(new)
+    assert mock_transcribe.call_args.args[0] == str(new)
+    assert mock_transcribe.call_args.kwargs["use_cache"] is False  # a resend is a retry
 
 
 def test_resend_with_no_recordings(tmp_path, monkeypatch):
@@ -177,13 +252,70 @@ def test_resend_with_no_recordings(tmp_path, monkeypatch):
     mock_transcribe.assert_not_called()
 
 
-def test_single_tap_stops_recording():
+@_by_name(s2t.OPTION_KEYS)
+def test_single_tap_stops_recording(key):
     """A single Option press while recording stops it."""
     s2t.recording = True
     s2t.last_option_press_time = 0
     try:
         with patch.object(s2t, "stop_recording") as mock_stop:
-            s2t.on_press(s2t.keyboard.Key.alt)
+            s2t.on_press(key)
         mock_stop.assert_called_once()
     finally:
         s2t.recording = False
+
+
+def test_start_sound_wait_overlaps_device_setup(take_dir):
+    """Device setup time counts toward the start sound's wait instead of adding to it."""
+    _reset_tap_state()
+    with (
+        patch.object(s2t, "play_sound"),
+        patch.object(s2t, "setup_audio"),
+        patch.object(s2t, "get_default_input_device", return_value=0),
+        patch.object(s2t.time, "monotonic", side_effect=[100.0, 100.3]),
+        patch.object(s2t.time, "sleep") as mock_sleep,
+        patch.object(s2t.threading, "Timer"),
+    ):
+        s2t.start_recording()
+    assert s2t.recording
+    mock_sleep.assert_called_once()
+    assert mock_sleep.call_args.args[0] == pytest.approx(s2t.START_SOUND_S - 0.3)
+
+
+def test_delivery_errors_are_logged_not_raised():
+    """A failing clipboard on the transcriber thread is logged rather than lost."""
+    with (
+        patch.object(s2t, "transcribe", return_value="hello"),
+        patch.object(s2t.pyperclip, "copy", side_effect=RuntimeError("no clipboard")),
+        patch.object(s2t.logger, "error") as mock_error,
+    ):
+        s2t.transcribe_and_paste("take.wav")
+    mock_error.assert_called_once()
+
+
+def test_auto_paste_sends_paste_shortcut():
+    """Auto-paste taps V with the platform's paste modifier held."""
+    with patch.object(s2t, "keyboard_controller") as mock_controller:
+        s2t.auto_paste()
+    assert mock_controller.pressed.call_args_list == [call(s2t.PASTE_MODIFIER)]
+    assert mock_controller.tap.call_args_list == [call("v")]
+
+
+def test_first_take_creates_temp_dir(take_dir, monkeypatch):
+    """The recordings directory is created on the first take, not at import."""
+    monkeypatch.setattr(s2t, "TEMP_DIR", str(take_dir / "recordings"))
+    s2t._open_take()
+    assert (take_dir / "recordings").is_dir()
+
+
+def test_fallback_to_first_input_device():
+    """With no preferred mic and no system default, the first input device is used."""
+    devices = [
+        {"index": 0, "name": "Some Speakers", "maxInputChannels": 0},
+        {"index": 1, "name": "USB Mic", "maxInputChannels": 1},
+    ]
+    s2t.audio = Mock(spec=s2t.pyaudio.PyAudio)
+    s2t.audio.get_device_count.return_value = len(devices)
+    s2t.audio.get_device_info_by_index.side_effect = lambda i: devices[i]
+    s2t.audio.get_default_input_device_info.side_effect = OSError("no default device")
+    assert s2t.get_default_input_device() == 1
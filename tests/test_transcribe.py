@@ -1,53 +1,322 @@
 """Tests for the transcription backends."""
 
-from unittest.mock import MagicMock, patch
+import collections
+import os
+import subprocess
+import sys
+import tempfile
+from unittest.mock import Mock, call, patch
 
+import numpy as np
+import pytest
+from speech import PHRASE_A, PHRASE_B, RATE, phrase
+
+from lumi import audio as audio_prep
 from lumi import transcribe as t
 
 
-def test_missing_file():
-    result = t.transcribe("does_not_exist.wav")
-    assert result == "[Transcription error: File not found]"
+@pytest.fixture(scope="module")
+def backend_mocks():
+    """One mock per backend, built once for the module."""
+    return {service: Mock(name=service) for service in t.SERVICES}
 
 
-def test_empty_file(tmp_path):
-    empty = tmp_path / "empty.wav"
-    empty.touch()
-    result = t.transcribe(str(empty))
-    assert result == "[Transcription error: File is empty]"
+@pytest.fixture
+def backends(backend_mocks, monkeypatch):
+    """The dispatch table with every backend mocked, each mock reset for this test."""
+    for service, backend in backend_mocks.items():
+        backend.reset_mock(return_value=True, side_effect=True)
+        monkeypatch.setitem(t._BACKENDS, service, backend)
+    return backend_mocks
 
 
-def test_unknown_service(tmp_path):
-    audio = tmp_path / "audio.wav"
-    audio.write_bytes(b"data")
-    result = t.transcribe(str(audio), service="groq")
-    assert result.startswith("[Transcription error:")
+@pytest.fixture
+def mlx(backends):
+    return backends["mlx"]
+
+
+@pytest.fixture
+def http():
+    """The remote backend's HTTP session, mocked."""
+    with patch.object(t, "_http_session", new_callable=Mock) as session_factory:
+        yield session_factory.return_value
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """A non-empty stand-in recording; mocked backends never decode it."""
+    path = tmp_path / "audio.wav"
+    path.write_bytes(b"data")
+    return path
+
 
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Point the transcript cache at a per-test file so tests never see each other's results."""
+    monkeypatch.setattr(t, "CACHE_FILE", str(tmp_path / "cache" / "cache.json"))
+    monkeypatch.setattr(t, "_cache", None)
+    monkeypatch.setattr(t, "_similar", collections.deque(maxlen=t.SIMILAR_CACHE_SIZE))
 
-def test_mlx_dispatch(tmp_path):
+
+@pytest.mark.parametrize("service", t.SERVICES)
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        (None, "[Transcription error: File not found]"),
+        (b"", "[Transcription error: File is empty]"),
+    ],
+    ids=["missing", "empty"],
+)
+def test_unusable_file_never_reaches_backend(tmp_path, backends, service, content, expected):
     audio = tmp_path / "audio.wav"
-    audio.write_bytes(b"data")
-    with patch.object(t, "_transcribe_mlx", return_value="hello") as mock_mlx:
-        result = t.transcribe(str(audio), service="mlx", model="some-model")
+    if content is not None:
+        audio.write_bytes(content)
+    assert t.transcribe(str(audio), service=service) == expected
+    backends[service].assert_not_called()
+
+
+def test_path_through_a_file_is_not_found(recording, mlx):
+    result = t.transcribe(str(recording / "audio.wav"))
+    assert result == "[Transcription error: File not found]"
+    mlx.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "service", ["groq", "MLX", "Remote", ""], ids=["other", "upper", "title", "empty"]
+)
+def test_unknown_service(recording, service):
+    """Service names are matched exactly; the CLI only offers the lowercase ones."""
+    result = t.transcribe(str(recording), service=service)
+    assert result.startswith("[Transcription error: Unknown service")
+
+
+@pytest.mark.parametrize("service", t.SERVICES)
+def test_dispatch(recording, backends, service):
+    backends[service].return_value = "hello"
+    result = t.transcribe(str(recording), service=service, model="some-model")
     assert result == "hello"
-    mock_mlx.assert_called_once_with(str(audio), "some-model")
+    assert backends[service].call_args_list == [call(str(recording), "some-model")]
 
 
-def test_remote(tmp_path):
-    audio = tmp_path / "audio.wav"
-    audio.write_bytes(b"data")
-    response = MagicMock()
-    response.json.return_value = {"text": "hello from server"}
-    with patch.object(t.requests, "post", return_value=response) as mock_post:
-        result = t.transcribe(str(audio), service="remote")
+@pytest.mark.parametrize("service", t.SERVICES)
+def test_backend_errors_are_wrapped(recording, backends, service):
+    backends[service].side_effect = RuntimeError("boom")
+    result = t.transcribe(str(recording), service=service)
+    assert result == "[Transcription error: boom]"
+
+
+def test_remote(recording, http):
+    http.post.return_value.json.return_value = {"text": "hello from server"}
+    result = t.transcribe(str(recording), service="remote")
     assert result == "hello from server"
-    url = mock_post.call_args.args[0]
+    url = http.post.call_args.args[0]
     assert url.endswith("/transcribe")
 
 
-def test_remote_error_is_wrapped(tmp_path):
-    audio = tmp_path / "audio.wav"
-    audio.write_bytes(b"data")
-    with patch.object(t.requests, "post", side_effect=ConnectionError("server down")):
-        result = t.transcribe(str(audio), service="remote")
+def test_remote_url_from_env(recording, http, monkeypatch):
+    monkeypatch.setenv("LUMI_REMOTE_URL", "http://asr.example:9000")
+    http.post.return_value.json.return_value = {"text": "hello"}
+    t.transcribe(str(recording), service="remote")
+    assert http.post.call_args.args[0] == "http://asr.example:9000/transcribe"
+
+
+def test_remote_error_is_wrapped(recording, http):
+    http.post.side_effect = ConnectionError("server down")
+    result = t.transcribe(str(recording), service="remote")
     assert result.startswith("[Transcription error:")
+
+
+def test_cache_hit_skips_backend(recording, mlx):
+    mlx.return_value = "hello"
+    assert t.transcribe(str(recording)) == "hello"
+    assert t.transcribe(str(recording)) == "hello"
+    mlx.assert_called_once()
+
+
+def test_cache_is_keyed_by_content_and_service(recording, mlx):
+    mlx.side_effect = ["one", "two", "three"]
+    assert t.transcribe(str(recording)) == "one"
+    recording.write_bytes(b"other data")
+    assert t.transcribe(str(recording)) == "two"
+    assert t.transcribe(str(recording), model="another-model") == "three"
+
+
+@pytest.mark.parametrize(
+    "service, env_var", [("mlx", "MLX_WHISPER_MODEL"), ("remote", "LUMI_REMOTE_URL")]
+)
+def test_cache_is_keyed_by_backend_env(recording, backends, monkeypatch, service, env_var):
+    backends[service].side_effect = ["one", "two"]
+    monkeypatch.setenv(env_var, "first")
+    assert t.transcribe(str(recording), service=service) == "one"
+    monkeypatch.setenv(env_var, "second")
+    assert t.transcribe(str(recording), service=service) == "two"
+
+
+def test_unreadable_file_returns_error_marker(tmp_path, http):
+    result = t.transcribe(str(tmp_path), service="remote")  # a directory passes the stat check
+    assert result.startswith("[Transcription error:")
+
+
+def test_bypassing_cache_transcribes_again_and_refreshes(recording, mlx):
+    mlx.side_effect = ["old model", "new model"]
+    assert t.transcribe(str(recording)) == "old model"
+    assert t.transcribe(str(recording), use_cache=False) == "new model"
+    assert t.transcribe(str(recording)) == "new model"
+
+
+def test_errors_are_not_cached(recording, mlx):
+    mlx.side_effect = [RuntimeError("boom"), "hello"]
+    assert t.transcribe(str(recording)).startswith("[Transcription error:")
+    assert t.transcribe(str(recording)) == "hello"
+
+
+def test_cache_survives_restart(recording, monkeypatch, mlx):
+    mlx.return_value = "hello"
+    t.transcribe(str(recording))
+    mlx.reset_mock()
+    monkeypatch.setattr(t, "_cache", None)  # as after a restart: reload from disk
+    assert t.transcribe(str(recording)) == "hello"
+    mlx.assert_not_called()
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(t, "CACHE_SIZE", 2)
+    t._cache_put("a", "A")
+    t._cache_put("b", "B")
+    t._cache_get("a")
+    t._cache_put("c", "C")
+    assert list(t._load_cache()) == ["a", "c"]
+
+
+def test_preload_warms_mlx_model(monkeypatch):
+    fake_mlx = Mock(spec=["transcribe"])
+    monkeypatch.setitem(sys.modules, "mlx_whisper", fake_mlx)
+    t.preload("mlx", model="some-model")
+    assert fake_mlx.transcribe.call_args.kwargs == {"path_or_hf_repo": "some-model"}
+
+
+@pytest.mark.parametrize(
+    "env_model, expected",
+    [(None, t.DEFAULT_MLX_MODEL), ("mlx-community/whisper-tiny", "mlx-community/whisper-tiny")],
+    ids=["default", "from-env"],
+)
+def test_preload_model_from_env(monkeypatch, env_model, expected):
+    if env_model is None:
+        monkeypatch.delenv("MLX_WHISPER_MODEL", raising=False)
+    else:
+        monkeypatch.setenv("MLX_WHISPER_MODEL", env_model)
+    fake_mlx = Mock(spec=["transcribe"])
+    monkeypatch.setitem(sys.modules, "mlx_whisper", fake_mlx)
+    t.preload("mlx")
+    assert fake_mlx.transcribe.call_args.kwargs == {"path_or_hf_repo": expected}
+
+
+def test_preload_failure_is_not_fatal(monkeypatch):
+    fake_mlx = Mock(spec=["transcribe"])
+    fake_mlx.transcribe.side_effect = RuntimeError("no Metal device")
+    monkeypatch.setitem(sys.modules, "mlx_whisper", fake_mlx)
+    t.preload("mlx")
+
+
+def test_preload_remote_is_a_no_op(monkeypatch):
+    monkeypatch.setitem(sys.modules, "mlx_whisper", None)  # importing it would raise
+    t.preload("remote")
+
+
+def test_import_leaves_backend_sdks_unloaded():
+    """Backends import their SDKs on first use, so importing lumi.transcribe (and
+    collecting these tests) never pays for mlx_whisper or requests."""
+    sdks = ("mlx_whisper", "requests")
+    code = f"import sys, lumi.transcribe; print([m for m in {sdks!r} if m in sys.modules])"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+def test_http_session_is_reused():
+    assert t._http_session() is t._http_session()
+
+
+def test_remote_long_audio_is_sent_as_one_batch(tmp_path, http):
+    rate = 16000
+    t_axis = np.arange(20 * rate) / rate
+    speech = (8000 * np.sin(2 * np.pi * 440 * t_axis)).astype(np.int16)
+    samples = np.concatenate([speech, np.zeros(rate // 2, dtype=np.int16), speech])
+    path = tmp_path / "long.wav"
+    audio_prep.save_wav(str(path), samples, rate)
+    http.post.return_value.json.return_value = {"texts": ["first", " second "]}
+
+    result = t.transcribe(str(path), service="remote")
+
+    assert result == "first second"
+    url = http.post.call_args.args[0]
+    assert url.endswith("/transcribe_batch")
+    uploads = http.post.call_args.kwargs["files"]
+    chunks = [np.frombuffer(wav[44:], dtype=np.int16) for _, (_, wav, _) in uploads]
+    assert len(chunks) == 2
+    assert np.array_equal(np.concatenate(chunks), samples)
+
+
+def test_gated_copy_is_removed(tmp_path, mlx):
+    samples = np.concatenate([np.zeros(16000, dtype=np.int16), np.full(16000, 5000, np.int16)])
+    path = tmp_path / "take.wav"
+    audio_prep.save_wav(str(path), samples, 16000)
+    mlx.side_effect = lambda gated_file, model: os.path.basename(gated_file)
+    gated_name = t.transcribe(str(path))
+    assert gated_name.startswith("lumi_gated_")
+    assert not os.path.exists(os.path.join(tempfile.gettempdir(), gated_name))
+
+
+def _save_phrase(path, formants, syllable_s=0.25, seed=0):
+    audio_prep.save_wav(str(path), phrase(formants, syllable_s, seed=seed), RATE)
+    return str(path)
+
+
+def test_reuse_similar_take(tmp_path, mlx):
+    first = _save_phrase(tmp_path / "first.wav", PHRASE_A)
+    # Said again, a bit faster
+    again = _save_phrase(tmp_path / "again.wav", PHRASE_A, syllable_s=0.23, seed=1)
+    mlx.return_value = "open the pod bay doors"
+    t.transcribe(first, reuse_similar=True)
+    assert t.transcribe(again, reuse_similar=True) == "open the pod bay doors"
+    mlx.assert_called_once()
+
+
+def test_similar_takes_are_transcribed_without_opt_in(tmp_path, mlx):
+    first = _save_phrase(tmp_path / "first.wav", PHRASE_A)
+    # Said again, a bit faster
+    again = _save_phrase(tmp_path / "again.wav", PHRASE_A, syllable_s=0.23, seed=1)
+    mlx.return_value = "hello"
+    t.transcribe(first)
+    t.transcribe(again)
+    assert mlx.call_count == 2
+
+
+def test_different_take_is_not_reused(tmp_path, mlx):
+    first = _save_phrase(tmp_path / "first.wav", PHRASE_A)
+    other = _save_phrase(tmp_path / "other.wav", PHRASE_B)
+    mlx.side_effect = ["one", "two"]
+    assert t.transcribe(first, reuse_similar=True) == "one"
+    assert t.transcribe(other, reuse_similar=True) == "two"
+
+
+def test_long_takes_are_not_fingerprinted(tmp_path, mlx, monkeypatch):
+    take = _save_phrase(tmp_path / "take.wav", PHRASE_A)  # 1 s
+    monkeypatch.setattr(t, "SIMILAR_MAX_TAKE_S", 0.5)
+    mlx.return_value = "hello"
+    with patch.object(audio_prep, "fingerprint") as mock_fingerprint:
+        t.transcribe(take, reuse_similar=True)
+    mock_fingerprint.assert_not_called()
+    assert not t._similar
+
+
+def test_reuse_among_equal_length_takes(tmp_path, mlx):
+    """Entries alike in everything but their fingerprints are told apart on reuse."""
+    a = _save_phrase(tmp_path / "a.wav", PHRASE_A)
+    b = _save_phrase(tmp_path / "b.wav", PHRASE_B)
+    b_again = _save_phrase(tmp_path / "b_again.wav", PHRASE_B, seed=1)
+    mlx.side_effect = ["one", "two"]
+    assert t.transcribe(a, reuse_similar=True) == "one"
+    assert t.transcribe(b, reuse_similar=True) == "two"
+    assert t.transcribe(b_again, reuse_similar=True) == "two"
+    assert [entry[-1] for entry in t._similar] == ["one", "two"]